@@ -1,11 +1,15 @@
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 
 from src.db import (
     safe_initialize,
     get_user,
-    get_user_chats,
-    save_chat,
+    get_user_chats_cached,
+    get_chat_version,
+    save_chat_user_only,
+    save_chat_ai_reply,
+    search_user_chats,
     get_uploaded_files,
     save_uploaded_file,
     delete_user_chats,
@@ -14,99 +18,187 @@ from src.db import (
 from src.auth import auth_page, verify_user_token
 from src.admin import show_admin_panel
 from src.helper import ai_chat_response
-from src.file_reader import extract_file
-from src.translation import to_english, to_hindi
 
 
 # ---------------- Page Config ----------------
 st.set_page_config(page_title="WINGMAN AI Assistant", page_icon="🤖", layout="wide")
 
 # ---------------- DB Initialization ----------------
-safe_initialize()
+@st.cache_resource
+def init_db():
+    # Runs once per server process rather than on every rerun
+    safe_initialize()
+    return True
+
+
+init_db()
+
+
+# ---------------- Background Workers ----------------
+@st.cache_resource
+def get_background_executor():
+    # Shared across reruns and sessions; file parsing and DB writes run here
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="worker")
+
+
+def process_upload(user_email, uploaded_file):
+    from src.file_reader import extract_file  # pulls in pandas/PyMuPDF, only needed on upload
+
+    extracted_text = extract_file(uploaded_file)
+    save_uploaded_file(user_email, uploaded_file.name, uploaded_file.type, extracted_text)
+
+
+def log_upload_failure(future):
+    # Catches failures that land after the page stopped waiting on the upload
+    error = future.exception()
+    if error:
+        print(f"❌ Failed to process uploaded file: {error}")
+
 
 # ---------------- Session Defaults ----------------
+CHAT_PAGE_SIZE = 50
+CHAT_WINDOW_STEP = 30
+CONTEXT_CHARS = 500
+CONTEXT_TOKEN_BUDGET = 1024
+UPLOAD_TIMEOUT = 60
+
 if "user" not in st.session_state:
     st.session_state.user = None
 if "theme" not in st.session_state:
     st.session_state.theme = "Light"
-if "chat_start_index" not in st.session_state:
-    st.session_state.chat_start_index = 0
+if "visible_chats" not in st.session_state:
+    st.session_state.visible_chats = None
+if "committed_search" not in st.session_state:
+    st.session_state.committed_search = ""
+if "search_results" not in st.session_state:
+    st.session_state.search_results = (None, [])
+if "window_size" not in st.session_state:
+    st.session_state.window_size = CHAT_WINDOW_STEP
+if "pending_message" not in st.session_state:
+    st.session_state.pending_message = None
+if "processed_upload" not in st.session_state:
+    st.session_state.processed_upload = None
+if "bubble_cache" not in st.session_state:
+    st.session_state.bubble_cache = {}
+    st.session_state.bubble_cache_theme = None
 
 
 # ---------------- Theme Helper ----------------
-def apply_theme(theme: str):
-    if theme == "Dark":
-        css = """
+# Built once at import; Streamlit drops elements that are not re-emitted on a rerun,
+# so the style block is still sent each run, but as an identical string the
+# frontend leaves in place instead of re-parsing.
+THEME_CSS = {
+    "Dark": """
         <style>
         .stApp {
             background-color: #111111 !important;
             color: #FFFFFF !important;
         }
         </style>
-        """
-    else:
-        css = """
+        """,
+    "Light": """
         <style>
         .stApp {
             background-color: #FFFFFF !important;
             color: #000000 !important;
         }
         </style>
-        """
-    st.markdown(css, unsafe_allow_html=True)
-
-
-# ---------------- Auto Scroll Helper ----------------
-def scroll_to_bottom():
-    st.markdown(
-        """
-        <script>
-        var elem = window.parent.document.querySelector('.main');
-        if (elem) { elem.scrollTop = elem.scrollHeight; }
-        </script>
         """,
-        unsafe_allow_html=True,
-    )
+}
 
 
-# ---------------- Helper: Display Chat Bubble ----------------
-def display_chat_bubble(sender, message, timestamp):
-    theme = st.session_state.get("theme", "Light")
+def apply_theme(theme: str):
+    st.markdown(THEME_CSS.get(theme, THEME_CSS["Light"]), unsafe_allow_html=True)
+
 
+# ---------------- Helper: Chat Bubbles ----------------
+def get_bubble_colors(theme: str):
     if theme == "Dark":
-        user_bg = "#005C4B"
-        ai_bg = "#202C33"
-        text_color = "white"
-    else:
-        user_bg = "#DCF8C6"
-        ai_bg = "#F1F0F0"
-        text_color = "black"
+        return {"user_bg": "#005C4B", "ai_bg": "#202C33", "text_color": "white"}
+    return {"user_bg": "#DCF8C6", "ai_bg": "#F1F0F0", "text_color": "black"}
+
 
+def render_bubble_html(sender, message, timestamp, colors):
+    text_color = colors["text_color"]
     bubble_style = (
         f"padding:10px; border-radius:12px; margin-bottom:5px; "
         f"max-width:60%; word-wrap:break-word; color:{text_color}; font-family:sans-serif;"
     )
 
     if sender == "user":
-        st.markdown(
-            f"""
-            <div style='{bubble_style} background-color:{user_bg}; float:right; clear:both;'>
-                <b style='color:{text_color};'>You:</b> {message}<br>
-                <small style='color:{text_color};'>{timestamp}</small>
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
+        bg, side, label = colors["user_bg"], "right", "You"
     else:
-        st.markdown(
-            f"""
-            <div style='{bubble_style} background-color:{ai_bg}; float:left; clear:both;'>
-                <b style='color:{text_color};'>AI:</b> {message}<br>
-                <small style='color:{text_color};'>{timestamp}</small>
-            </div>
-            """,
-            unsafe_allow_html=True
+        bg, side, label = colors["ai_bg"], "left", "AI"
+
+    return f"""
+        <div style='{bubble_style} background-color:{bg}; float:{side}; clear:both;'>
+            <b style='color:{text_color};'>{label}:</b> {message}<br>
+            <small style='color:{text_color};'>{timestamp}</small>
+        </div>
+        """
+
+
+def get_chat_html(chat, theme):
+    # Saved chats never change, so their HTML is cached per chat id for the current theme
+    if st.session_state.bubble_cache_theme != theme:
+        st.session_state.bubble_cache = {}
+        st.session_state.bubble_cache_theme = theme
+
+    cache = st.session_state.bubble_cache
+    html = cache.get(chat["id"])
+    if html is None:
+        colors = get_bubble_colors(theme)
+        html = (
+            render_bubble_html("user", chat["user_input"], chat["timestamp"], colors)
+            + render_bubble_html("ai", chat["ai_response"], chat["timestamp"], colors)
         )
+        cache[chat["id"]] = html
+    return html
+
+
+# ---------------- Helper: Prompt Context ----------------
+def select_context(chats, budget=CONTEXT_TOKEN_BUDGET):
+    # Newest turns first until the rough token estimate (~4 chars/token) would exceed the budget
+    selected = []
+    used = 0
+    for c in reversed(chats):
+        cost = (min(len(c["user_input"]), CONTEXT_CHARS) + min(len(c["ai_response"]), CONTEXT_CHARS)) // 4
+        if used + cost > budget:
+            break
+        selected.append(c)
+        used += cost
+    selected.reverse()
+    return selected
+
+
+def build_history_prompt(chats):
+    # Each turn is capped so one long reply can't dominate the prompt
+    return "".join(
+        f"User: {c['user_input'][:CONTEXT_CHARS]}\nAI: {c['ai_response'][:CONTEXT_CHARS]}\n\n"
+        for c in chats
+    )
+
+
+# ---------------- Helper: Current User ----------------
+def get_current_user():
+    # Re-read every rerun: get_user is served from the 30s USER_CACHE, and block/role
+    # changes invalidate it, so they reach sessions that are already logged in
+    return get_user(st.session_state.user)
+
+
+# ---------------- Emoji Picker ----------------
+@st.fragment
+def emoji_picker():
+    # A fragment, so picking an emoji reruns only this block instead of the whole page
+    st.selectbox(
+        "Emoji",
+        ["", "😀", "😂", "😍", "😎", "🤖", "🙌", "👍", "👎", "❓"],
+        key="emoji_picker",
+    )
+    if st.button("Send emoji") and st.session_state.emoji_picker:
+        # Emoji-only messages go through the full run like a typed message
+        st.session_state.pending_message = st.session_state.emoji_picker
+        st.rerun()
 
 
 # ---------------- User Panel ----------------
@@ -116,16 +208,11 @@ def show_user_panel():
         st.stop()
 
     user_email = st.session_state.user
-    user = get_user(user_email)
+    user = get_current_user()
     user_name = user.get("name", "User")
 
-    all_chats_db = get_user_chats(user_email)
-    total_chats = len(all_chats_db)
-
-    if st.session_state.chat_start_index > total_chats:
-        st.session_state.chat_start_index = 0
-
-    visible_chats = all_chats_db[st.session_state.chat_start_index:]
+    if st.session_state.visible_chats is None:
+        st.session_state.visible_chats = get_user_chats_cached(user_email, limit=CHAT_PAGE_SIZE)
 
     # ---------- Sidebar ----------
     with st.sidebar:
@@ -138,34 +225,61 @@ def show_user_panel():
         )
         st.session_state.theme = theme_choice
 
+        if st.button("⬆️ Load older"):
+            # Grow the rendered window first; only hit the DB once it runs past the buffer
+            buffer = st.session_state.visible_chats
+            st.session_state.window_size += CHAT_WINDOW_STEP
+            if st.session_state.window_size > len(buffer):
+                before_id = buffer[0]["id"] if buffer else None
+                older = get_user_chats_cached(user_email, before_id=before_id, limit=CHAT_PAGE_SIZE)
+                if older:
+                    st.session_state.visible_chats = older + buffer
+                elif st.session_state.window_size - CHAT_WINDOW_STEP >= len(buffer):
+                    st.session_state.window_size -= CHAT_WINDOW_STEP
+                    st.info("No older messages.")
+
         if st.button("🆕 New Chat"):
-            st.session_state.chat_start_index = total_chats
+            st.session_state.visible_chats = []
+            st.session_state.window_size = CHAT_WINDOW_STEP
             st.success("Started a new chat (previous chats are still saved).")
 
         if st.button("📜 Show Previous Chat"):
-            st.session_state.chat_start_index = 0
-            st.success("Showing full conversation history.")
+            st.session_state.visible_chats = get_user_chats_cached(user_email, limit=CHAT_PAGE_SIZE)
+            st.session_state.window_size = CHAT_WINDOW_STEP
+            st.success("Showing recent conversation history.")
 
         if st.button("🧹 Clear Chat History"):
             delete_user_chats(user_email)
-            st.session_state.chat_start_index = 0
+            st.session_state.visible_chats = []
             st.success("All chat history deleted from database.")
 
         if st.button("🔒 Logout"):
             st.session_state.user = None
-            st.session_state.chat_start_index = 0
+            st.session_state.visible_chats = None
+            st.session_state.window_size = CHAT_WINDOW_STEP
+            st.session_state.committed_search = ""
+            st.session_state.search_results = (None, [])
             st.rerun()
 
+    visible_chats = st.session_state.visible_chats
+
     apply_theme(st.session_state.theme)
 
     # ---------- File Upload ----------
     st.markdown("## 📁 Upload a File")
     uploaded_file = st.file_uploader("Upload file", type=["pdf", "txt", "xlsx", "csv"])
-    if uploaded_file:
+    # The uploader keeps its file across reruns, so only process each upload once
+    if uploaded_file and st.session_state.processed_upload != uploaded_file.file_id:
+        # Mark the upload handled up front so a failed file is not re-parsed on every rerun
+        st.session_state.processed_upload = uploaded_file.file_id
+        future = get_background_executor().submit(process_upload, user_email, uploaded_file)
+        future.add_done_callback(log_upload_failure)
         try:
-            extracted_text = extract_file(uploaded_file)
-            save_uploaded_file(user_email, uploaded_file.name, uploaded_file.type, extracted_text)
+            with st.spinner("Processing file…"):
+                future.result(timeout=UPLOAD_TIMEOUT)
             st.success("✅ File processed and saved.")
+        except FutureTimeoutError:
+            st.warning("⏳ File is still being processed; check back shortly to see if it was saved.")
         except Exception as e:
             st.error(f"❌ Error: {e}")
 
@@ -175,69 +289,80 @@ def show_user_panel():
         st.markdown("## 🕘 Conversation History")
 
     with col2:
-        search_query = st.text_input(
-            "Search messages",
-            key="search_top",
-            label_visibility="collapsed",
-            placeholder="Search in conversation…",
-        )
-
-    if search_query:
-        q = search_query.lower()
-        displayed_chats = [
-            c for c in visible_chats
-            if q in c["user_input"].lower() or q in c["ai_response"].lower()
-        ]
+        with st.form("search_form", clear_on_submit=False):
+            search_query = st.text_input(
+                "Search messages",
+                key="search_top",
+                label_visibility="collapsed",
+                placeholder="Search in conversation…",
+            )
+            submitted = st.form_submit_button("🔍")
+
+    if submitted:
+        st.session_state.committed_search = search_query.strip()
+
+    # Only the committed query is searched, and its results are reused until chats change
+    committed_search = st.session_state.committed_search
+    if committed_search:
+        search_key = (committed_search, get_chat_version(user_email))
+        cached_key, cached_results = st.session_state.search_results
+        if cached_key != search_key:
+            cached_results = search_user_chats(user_email, committed_search)
+            st.session_state.search_results = (search_key, cached_results)
+        displayed_chats = cached_results
     else:
-        displayed_chats = visible_chats
-
-    for chat in displayed_chats:
-        display_chat_bubble("user", chat["user_input"], chat["timestamp"])
-        display_chat_bubble("ai", chat["ai_response"], chat["timestamp"])
+        # Only mount the tail of the history; "Load older" widens the window
+        displayed_chats = visible_chats[-st.session_state.window_size:]
 
-    scroll_to_bottom()
+    # One st.markdown call for the whole history instead of one per bubble
+    theme = st.session_state.theme
+    html_parts = [get_chat_html(chat, theme) for chat in displayed_chats]
+    if html_parts:
+        st.markdown("".join(html_parts), unsafe_allow_html=True)
 
     st.write("---")
 
     # ---------- Bottom chat bar ----------
-    with st.form("chat_form_bottom"):
-        colA, colB, colC = st.columns([5, 1.5, 1])
-
-        with colA:
-            new_message = st.text_input(
-                "Message",
-                key="bottom_input",
-                label_visibility="collapsed",
-                placeholder="Type your message...",
-            )
+    emoji_picker()
+    emoji = st.session_state.emoji_picker
 
-        with colB:
-            emoji = st.selectbox(
-                "Emoji",
-                ["", "😀", "😂", "😍", "😎", "🤖", "🙌", "👍", "👎", "❓"],
-                key="emoji_picker",
-                label_visibility="collapsed",
-            )
-
-        with colC:
-            send_bottom = st.form_submit_button("Send")
-
-    if send_bottom and (new_message.strip() or emoji):
+    # st.chat_input is pinned to the bottom of the page and clears itself on submit
+    new_message = st.chat_input("Type your message...")
+    text = None
+    if new_message and new_message.strip():
         text = new_message.strip()
         if emoji:
             text = (text + " " + emoji).strip()
+    elif st.session_state.pending_message:
+        text = st.session_state.pending_message
+    st.session_state.pending_message = None
 
-        context = visible_chats[-5:]
-        history = "".join(
-            f"User: {c['user_input']}\nAI: {c['ai_response']}\n\n"
-            for c in context
-        )
+    if text:
+        history = build_history_prompt(select_context(visible_chats))
         prompt = history + f"User: {text}\nAI:"
 
-        with st.spinner("Thinking... 🤖"):
-            ai_reply = ai_chat_response(prompt)
-
-        save_chat(user_email, text, ai_reply)
+        with st.chat_message("user"):
+            st.markdown(text)
+        # Write the user's turn while the model is thinking, then fill in the reply
+        save_future = get_background_executor().submit(save_chat_user_only, user_email, text)
+        with st.chat_message("assistant"):
+            with st.spinner("Thinking... 🤖"):
+                ai_reply = ai_chat_response(prompt)
+                # Persist the reply before any further st.* call: a widget click raises
+                # Streamlit's rerun there and would leave a half-saved turn behind
+                chat_id = save_future.result()
+                save_chat_ai_reply(chat_id, ai_reply)
+                # Same for the session buffer, which is only refetched when it is None
+                visible_chats.append({
+                    "id": chat_id,
+                    "user_email": user_email,
+                    "user_input": text,
+                    "ai_response": ai_reply,
+                    "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+                })
+            st.markdown(ai_reply)
+
+        st.rerun()
 
 
 # ---------------- Main App ----------------
@@ -260,8 +385,12 @@ def main():
     if not st.session_state.user:
         auth_page()
     else:
-        user = get_user(st.session_state.user)
-        if user.get("role") == "admin":
+        user = get_current_user()
+        if not user or user.get("blocked"):
+            st.session_state.user = None
+            st.error("❌ This account is no longer available.")
+            auth_page()
+        elif user.get("role") == "admin":
             show_admin_panel()
         else:
             show_user_panel()
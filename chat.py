@@ -1,6 +1,4 @@
 import streamlit as st
-from src.voice_input import get_voice_input
-from src.translation import to_english, to_hindi
 from src.helper import ai_chat_response
 
 # Optional: user preference stored in session
@@ -14,6 +12,8 @@ lang_code = "hi-IN" if language == "Hindi" else "en-US"
 text_input = st.text_area("💬 Type your message")
 
 if voice_enabled:
+    from src.voice_input import get_voice_input
+
     voice_text = get_voice_input(language=lang_code)
     if voice_text:
         text_input = voice_text
@@ -22,6 +22,10 @@ if voice_enabled:
 if text_input:
     st.markdown(f"📝 Your message: `{text_input}`")
 
+    if language == "Hindi":
+        # googletrans is only needed for Hindi, so import it on demand
+        from src.translation import to_english, to_hindi
+
     # Translate to English if input is in Hindi
     query = to_english(text_input, src_lang="hi") if language == "Hindi" else text_input
 
@@ -1,6 +1,5 @@
 import streamlit as st
-import hashlib
-import uuid
+import secrets
 from datetime import datetime, timedelta
 
 from src.db import (
@@ -9,6 +8,7 @@ from src.db import (
     verify_user_token
 )
 from src.email_utils import send_verification_email, send_reset_email
+from src.security import hash_password
 
 # ---------------- Default auth mode ----------------
 if "auth_mode" not in st.session_state:
@@ -76,8 +76,8 @@ def signup_form():
 
     if st.button("Sign Up"):
         if name and email and password:
-            hashed = hashlib.sha256(password.encode()).hexdigest()
-            token = str(uuid.uuid4())
+            hashed = hash_password(password)
+            token = secrets.token_urlsafe(32)
             success = create_user(email, hashed, name, profession, token)
             if success:
                 send_verification_email(email, token)
@@ -99,7 +99,7 @@ def forgot_password_form():
     if st.button("Send Reset Link"):
         user = get_user(email)
         if user:
-            token = str(uuid.uuid4())
+            token = secrets.token_urlsafe(32)
             expiry = datetime.now() + timedelta(hours=1)
             update_reset_token(email, token, expiry)
             send_reset_email(email, token)
@@ -127,7 +127,7 @@ def reset_password_form():
             st.error("❌ Passwords do not match.")
             return
 
-        hashed = hashlib.sha256(new_password.encode()).hexdigest()
+        hashed = hash_password(new_password)
         if reset_user_password_by_token(token, hashed):
             st.success("✅ Password reset successfully. You can now log in.")
             st.session_state.auth_mode = "login"
@@ -1,90 +1,265 @@
 import os
 import sys
+import atexit
+import csv
+import time
 import sqlite3
-from datetime import datetime, timedelta
-import pandas as pd
-import hashlib
+import threading
+import streamlit as st
+from cachetools import TTLCache
+from contextlib import contextmanager
 import io
 
+from src.security import hash_password, is_valid_email, needs_rehash, verify_password
+
 DB_FILE = "omnisicient.db"
 
+# Serialises writers on the shared connection so multi-statement flows don't interleave
+WRITE_LOCK = threading.RLock()
+
+# Short-lived user rows for the per-rerun auth checks; writers call invalidate_user()
+USER_CACHE = TTLCache(maxsize=2048, ttl=30)
+USER_CACHE_LOCK = threading.Lock()
+
+# Process-wide per-user chat version, bumped by every chat write; keys get_user_chats_cached
+CHAT_VERSIONS = {}
+CHAT_VERSIONS_LOCK = threading.Lock()
+
 
 # ---------------- Database Connection ----------------
+@st.cache_resource
 def get_connection():
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    # One shared autocommit connection per process; WAL lets chat reads run alongside writes
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None, cached_statements=512)
     conn.row_factory = sqlite3.Row
+    # page_size only takes effect on a brand-new file, so it must run before WAL and any DDL
+    conn.execute("PRAGMA page_size=8192")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-64000")
     return conn
 
 
+@contextmanager
+def write_transaction(cursor):
+    # BEGIN IMMEDIATE takes the write lock up front, so a read-then-write flow can't race
+    with WRITE_LOCK:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+
+
+# ---------------- Row Helpers ----------------
+def tuple_cursor(conn):
+    # Plain tuple rows; list queries build their dicts directly instead of via sqlite3.Row
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+def fetch_dicts(cursor):
+    names = [col[0] for col in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
 # ---------------- Table Creation ----------------
+# Bump whenever create_tables() changes so existing databases re-run the DDL once
+SCHEMA_VERSION = 2
+
+# Token expiries are UNIX seconds so the expiry check is a plain integer comparison in SQL
+USERS_COLUMNS = """
+    email TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    name TEXT,
+    profession TEXT,
+    verified INTEGER DEFAULT 0,
+    verification_token TEXT,
+    verification_token_expiry INTEGER,
+    reset_token TEXT,
+    reset_token_expiry INTEGER,
+    blocked INTEGER DEFAULT 0,
+    role TEXT DEFAULT 'user'
+"""
+
+SCHEMA_DDL = f"""
+BEGIN IMMEDIATE;
+
+CREATE TABLE IF NOT EXISTS users ({USERS_COLUMNS});
+
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_email TEXT,
+    user_input TEXT,
+    ai_response TEXT,
+    thread_id TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(user_email) REFERENCES users(email)
+);
+
+CREATE TABLE IF NOT EXISTS uploaded_files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_email TEXT,
+    file_name TEXT,
+    file_type TEXT,
+    extracted_text TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(user_email) REFERENCES users(email)
+);
+
+CREATE TABLE IF NOT EXISTS email_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT,
+    subject TEXT,
+    status TEXT,
+    error TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per-user chat lookups walk chats_user_idx newest-first
+CREATE INDEX IF NOT EXISTS chats_user_idx ON chats(user_email, id DESC);
+DROP INDEX IF EXISTS idx_chats_user_ts;
+CREATE INDEX IF NOT EXISTS idx_files_user_ts ON uploaded_files(user_email, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_email_logs_ts ON email_logs(timestamp DESC);
+
+COMMIT;
+"""
+
+
 def create_tables():
     conn = get_connection()
     cursor = conn.cursor()
 
-    # Users table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        email TEXT PRIMARY KEY,
-        password TEXT NOT NULL,
-        name TEXT,
-        profession TEXT,
-        verified INTEGER DEFAULT 0,
-        verification_token TEXT,
-        verification_token_expiry TEXT,
-        reset_token TEXT,
-        reset_token_expiry TEXT,
-        blocked INTEGER DEFAULT 0,
-        role TEXT DEFAULT 'user'
-    );
-    """)
+    # Warm databases already carry the current schema: one PRAGMA read instead of all the DDL
+    cursor.execute("PRAGMA user_version")
+    if cursor.fetchone()[0] == SCHEMA_VERSION:
+        return
 
-    # Chats table
+    # Static tables and indexes in one parse and one transaction
+    with WRITE_LOCK:
+        try:
+            conn.executescript(SCHEMA_DDL)
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    migrate_token_expiry_columns(cursor)
+
+    # Token columns are NULL for most users, so partial indexes keep those btrees small,
+    # and UNIQUE makes each token lookup a single-row point probe.
+    cursor.execute("DROP INDEX IF EXISTS idx_users_vtoken")
+    cursor.execute("DROP INDEX IF EXISTS idx_users_rtoken")
+    try:
+        cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_vtoken_uq ON users(verification_token)
+        WHERE verification_token IS NOT NULL;
+        """)
+        cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_rtoken_uq ON users(reset_token)
+        WHERE reset_token IS NOT NULL;
+        """)
+    except sqlite3.IntegrityError:
+        # Duplicate legacy tokens: keep plain indexes rather than failing startup
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_vtoken ON users(verification_token)
+        WHERE verification_token IS NOT NULL;
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_rtoken ON users(reset_token)
+        WHERE reset_token IS NOT NULL;
+        """)
+
+    # Full-text index over chats, kept in sync with triggers
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chats_fts'")
+    fts_exists = cursor.fetchone() is not None
+    try:
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+            user_input,
+            ai_response,
+            content=chats,
+            content_rowid=id,
+            tokenize="unicode61 remove_diacritics 2"
+        );
+        """)
+        fts_available = True
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: search_user_chats falls back to LIKE
+        fts_available = False
+
+    if fts_available:
+        create_chat_fts_triggers(cursor)
+        if not fts_exists:
+            # Index chats that were saved before the FTS table existed
+            cursor.execute("INSERT INTO chats_fts(chats_fts) VALUES ('rebuild')")
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_token_expiry_columns(cursor):
+    # Older databases stored expiries as local "%Y-%m-%d %H:%M:%S" TEXT; SQLite can't
+    # change a column type in place, so rebuild the table and convert the values.
+    cursor.execute("PRAGMA table_info(users)")
+    column_types = {row["name"]: row["type"].upper() for row in cursor.fetchall()}
+    if column_types.get("verification_token_expiry") == "INTEGER":
+        return
+
+    with write_transaction(cursor):
+        cursor.execute("DROP TABLE IF EXISTS users_new")
+        cursor.execute(f"CREATE TABLE users_new ({USERS_COLUMNS});")
+        cursor.execute("""
+            INSERT INTO users_new (
+                email, password, name, profession, verified,
+                verification_token, verification_token_expiry,
+                reset_token, reset_token_expiry, blocked, role
+            )
+            SELECT
+                email, password, name, profession, verified,
+                verification_token, CAST(strftime('%s', verification_token_expiry, 'utc') AS INTEGER),
+                reset_token, CAST(strftime('%s', reset_token_expiry, 'utc') AS INTEGER),
+                blocked, role
+            FROM users
+        """)
+        cursor.execute("DROP TABLE users")
+        cursor.execute("ALTER TABLE users_new RENAME TO users")
+
+
+def create_chat_fts_triggers(cursor):
     cursor.execute("""
-    CREATE TABLE IF NOT EXISTS chats (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_email TEXT,
-        user_input TEXT,
-        ai_response TEXT,
-        thread_id TEXT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(user_email) REFERENCES users(email)
-    );
+    CREATE TRIGGER IF NOT EXISTS chats_fts_ai AFTER INSERT ON chats BEGIN
+        INSERT INTO chats_fts(rowid, user_input, ai_response)
+        VALUES (new.id, new.user_input, new.ai_response);
+    END;
     """)
-
-    # Uploaded files table
     cursor.execute("""
-    CREATE TABLE IF NOT EXISTS uploaded_files (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_email TEXT,
-        file_name TEXT,
-        file_type TEXT,
-        extracted_text TEXT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(user_email) REFERENCES users(email)
-    );
+    CREATE TRIGGER IF NOT EXISTS chats_fts_ad AFTER DELETE ON chats BEGIN
+        INSERT INTO chats_fts(chats_fts, rowid, user_input, ai_response)
+        VALUES ('delete', old.id, old.user_input, old.ai_response);
+    END;
     """)
-
-    # Email logs table
     cursor.execute("""
-    CREATE TABLE IF NOT EXISTS email_logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        recipient TEXT,
-        subject TEXT,
-        status TEXT,
-        error TEXT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-    );
+    CREATE TRIGGER IF NOT EXISTS chats_fts_au AFTER UPDATE ON chats BEGIN
+        INSERT INTO chats_fts(chats_fts, rowid, user_input, ai_response)
+        VALUES ('delete', old.id, old.user_input, old.ai_response);
+        INSERT INTO chats_fts(rowid, user_input, ai_response)
+        VALUES (new.id, new.user_input, new.ai_response);
+    END;
     """)
 
-    conn.commit()
-    conn.close()
-
 
 # ---------------- Safe Initialization ----------------
 def safe_initialize():
     try:
         create_tables()
     except sqlite3.DatabaseError as e:
+        # Drop the cached connection so the rebuilt file gets a fresh one
+        get_connection.clear()
         try:
             backup_path = DB_FILE + ".corrupt.bak"
             os.rename(DB_FILE, backup_path)
@@ -98,153 +273,263 @@ def safe_initialize():
 
 
 # ---------------- User Functions ----------------
+def invalidate_user(email):
+    with USER_CACHE_LOCK:
+        USER_CACHE.pop(email, None)
+
+
 def create_user(email, password_hash, name="", profession="", verification_token=None):
+    if not is_valid_email(email):
+        return False
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-    if cursor.fetchone():
-        conn.close()
-        return False
-
-    expiry = (datetime.now() + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("""
-        INSERT INTO users (email, password, name, profession, verified, verification_token, verification_token_expiry)
-        VALUES (?, ?, ?, ?, 0, ?, ?)
-    """, (email, password_hash, name, profession, verification_token, expiry))
-
-    conn.commit()
-    conn.close()
-    return True
+    expiry = int(time.time()) + 3600
+    with WRITE_LOCK:
+        # One statement instead of SELECT + INSERT; RETURNING yields nothing if the email exists
+        cursor.execute("""
+            INSERT INTO users (email, password, name, profession, verified, verification_token, verification_token_expiry)
+            VALUES (?, ?, ?, ?, 0, ?, ?)
+            ON CONFLICT(email) DO NOTHING
+            RETURNING email
+        """, (email, password_hash, name, profession, verification_token, expiry))
+        created = cursor.fetchall()
+    invalidate_user(email)
+    return bool(created)
 
 
 def get_user(email):
+    if not is_valid_email(email):
+        return None
+    with USER_CACHE_LOCK:
+        cached = USER_CACHE.get(email)
+    if cached is not None:
+        return dict(cached)
+
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
     user = cursor.fetchone()
-    conn.close()
-    return dict(user) if user else None
+    if not user:
+        return None
+
+    user = dict(user)
+    with USER_CACHE_LOCK:
+        USER_CACHE[email] = user
+    return dict(user)
 
 
 def is_user_verified(email):
-    user = get_user(email)
-    return user and user.get("verified") == 1
+    if not is_valid_email(email):
+        return False
+    with USER_CACHE_LOCK:
+        cached = USER_CACHE.get(email)
+    if cached is not None:
+        return cached.get("verified") == 1
+
+    conn = get_connection()
+    cursor = tuple_cursor(conn)
+    cursor.execute("SELECT verified FROM users WHERE email = ? LIMIT 1", (email,))
+    row = cursor.fetchone()
+    return bool(row and row[0] == 1)
 
 
 def update_reset_token(email, token, expiry):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE users SET reset_token = ?, reset_token_expiry = ?
-        WHERE email = ?
-    """, (token, expiry.strftime("%Y-%m-%d %H:%M:%S"), email))
-    conn.commit()
-    conn.close()
+    with WRITE_LOCK:
+        cursor.execute("""
+            UPDATE users SET reset_token = ?, reset_token_expiry = ?
+            WHERE email = ?
+        """, (token, int(expiry.timestamp()), email))
+    invalidate_user(email)
 
 
 def reset_user_password_by_token(token, new_hashed_password):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT email, reset_token_expiry FROM users WHERE reset_token = ?", (token,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return False
-
-    email = row["email"]
-    expiry = datetime.strptime(row["reset_token_expiry"], "%Y-%m-%d %H:%M:%S")
-    if datetime.now() > expiry:
-        conn.close()
+    with WRITE_LOCK:
+        # Check and consume the token in one statement; no row back means invalid or expired
+        cursor.execute("""
+            UPDATE users
+            SET password = ?, reset_token = NULL, reset_token_expiry = NULL
+            WHERE reset_token = ? AND reset_token_expiry > ?
+            RETURNING email
+        """, (new_hashed_password, token, int(time.time())))
+        rows = cursor.fetchall()
+    if not rows:
         return False
-
-    cursor.execute("""
-        UPDATE users
-        SET password = ?, reset_token = NULL, reset_token_expiry = NULL
-        WHERE email = ?
-    """, (new_hashed_password, email))
-    conn.commit()
-    conn.close()
+    invalidate_user(rows[0]["email"])
     return True
 
 
 def verify_user_credentials(email, password):
-    hashed = hashlib.sha256(password.encode()).hexdigest()
+    if not is_valid_email(email):
+        return False
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE email = ? AND password = ?", (email, hashed))
-    user = cursor.fetchone()
-    conn.close()
-    return user is not None
+    cursor.execute("SELECT password FROM users WHERE email = ? AND blocked = 0 LIMIT 1", (email,))
+    row = cursor.fetchone()
+    if row is None or not verify_password(password, row["password"]):
+        return False
+
+    if needs_rehash(row["password"]):
+        # Upgrade legacy hashes while the plaintext is available
+        with WRITE_LOCK:
+            cursor.execute(
+                "UPDATE users SET password = ? WHERE email = ? AND password = ?",
+                (hash_password(password), email, row["password"]),
+            )
+        invalidate_user(email)
+    return True
 
 
 def verify_user_token(token):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT email, verified, verification_token_expiry FROM users WHERE verification_token = ?", (token,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
+    with WRITE_LOCK:
+        cursor.execute("""
+            UPDATE users
+            SET verified = 1, verification_token = NULL, verification_token_expiry = NULL
+            WHERE verification_token = ? AND verification_token_expiry > ?
+            RETURNING email
+        """, (token, int(time.time())))
+        rows = cursor.fetchall()
+    if not rows:
         return False
+    invalidate_user(rows[0]["email"])
+    return True
 
-    expiry = datetime.strptime(row["verification_token_expiry"], "%Y-%m-%d %H:%M:%S")
-    if datetime.now() > expiry:
-        conn.close()
-        return False
 
-    if row["verified"]:
-        conn.close()
-        return True
+# ---------------- Chat Functions ----------------
+def bump_chat_version(user_email):
+    with CHAT_VERSIONS_LOCK:
+        CHAT_VERSIONS[user_email] = CHAT_VERSIONS.get(user_email, 0) + 1
 
-    cursor.execute("""
-        UPDATE users
-        SET verified = 1, verification_token = NULL, verification_token_expiry = NULL
-        WHERE email = ?
-    """, (row["email"],))
-    conn.commit()
-    conn.close()
-    return True
+
+def get_chat_version(user_email):
+    with CHAT_VERSIONS_LOCK:
+        return CHAT_VERSIONS.get(user_email, 0)
 
 
-# ---------------- Chat Functions ----------------
 def save_chat(user_email, user_input, ai_response, thread_id=None):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO chats (user_email, user_input, ai_response, thread_id)
-        VALUES (?, ?, ?, ?)
-    """, (user_email, user_input, ai_response, thread_id))
-    conn.commit()
-    conn.close()
+    with WRITE_LOCK:
+        cursor.execute("""
+            INSERT INTO chats (user_email, user_input, ai_response, thread_id)
+            VALUES (?, ?, ?, ?)
+        """, (user_email, user_input, ai_response, thread_id))
+        chat_id = cursor.lastrowid
+    bump_chat_version(user_email)
+    return chat_id
+
+
+def save_chat_user_only(user_email, user_input, thread_id=None):
+    # Persists the user's turn while the AI reply is still being generated
+    return save_chat(user_email, user_input, "", thread_id)
 
 
-def get_user_chats(user_email):
+def save_chat_ai_reply(chat_id, ai_response):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM chats WHERE user_email = ? ORDER BY timestamp ASC", (user_email,))
-    chats = cursor.fetchall()
-    conn.close()
-    return [dict(chat) for chat in chats]
+    with WRITE_LOCK:
+        cursor.execute(
+            "UPDATE chats SET ai_response = ? WHERE id = ? RETURNING user_email",
+            (ai_response, chat_id),
+        )
+        rows = cursor.fetchall()
+    if rows:
+        bump_chat_version(rows[0][0])
+
+
+def get_user_chats_page(user_email, before_id=None, limit=50):
+    # Newest `limit` chats older than `before_id`, returned oldest-first for display.
+    conn = get_connection()
+    cursor = tuple_cursor(conn)
+    if before_id is None:
+        cursor.execute(
+            "SELECT * FROM chats WHERE user_email = ? ORDER BY id DESC LIMIT ?",
+            (user_email, limit),
+        )
+    else:
+        cursor.execute(
+            "SELECT * FROM chats WHERE user_email = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (user_email, before_id, limit),
+        )
+    return fetch_dicts(cursor)[::-1]
+
+
+# `version` is only a cache key. st.cache_data is shared by every session, so it comes from
+# the process-wide CHAT_VERSIONS that the chat writers bump, never from session state.
+@st.cache_data(ttl=60)
+def _get_user_chats_page_cached(user_email, version, before_id, limit):
+    return get_user_chats_page(user_email, before_id=before_id, limit=limit)
+
+
+def get_user_chats_cached(user_email, before_id=None, limit=50):
+    return _get_user_chats_page_cached(user_email, get_chat_version(user_email), before_id, limit)
+
+
+def search_user_chats(user_email, query, limit=50):
+    # Quote every term so user input is never parsed as FTS5 query syntax, and make each a
+    # prefix match so partial words ("hel", "llm") still find "hello" and "LLMs"
+    terms = ['"' + term.replace('"', '""') + '"*' for term in query.split()]
+    if not terms:
+        return []
+    conn = get_connection()
+    cursor = tuple_cursor(conn)
+    try:
+        cursor.execute("""
+            SELECT chats.* FROM chats
+            JOIN chats_fts ON chats.id = chats_fts.rowid
+            WHERE chats_fts MATCH ? AND chats.user_email = ?
+            ORDER BY bm25(chats_fts)
+            LIMIT ?
+        """, (" ".join(terms), user_email, limit))
+    except sqlite3.OperationalError:
+        return search_user_chats_like(user_email, query, limit)
+    # Tokens only match from their start; fall back to a substring scan for mid-word queries
+    return fetch_dicts(cursor) or search_user_chats_like(user_email, query, limit)
+
+
+def search_user_chats_like(user_email, query, limit=200):
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{escaped}%"
+    conn = get_connection()
+    cursor = tuple_cursor(conn)
+    # LIKE is already case-insensitive for ASCII, so no lower() on either side
+    cursor.execute("""
+        SELECT * FROM chats
+        WHERE user_email = ?
+          AND (user_input LIKE ? ESCAPE '\\' OR ai_response LIKE ? ESCAPE '\\')
+        ORDER BY id DESC
+        LIMIT ?
+    """, (user_email, pattern, pattern, limit))
+    return fetch_dicts(cursor)
 
 
 def delete_user_chats(user_email):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM chats WHERE user_email = ?", (user_email,))
-    conn.commit()
-    conn.close()
+    with WRITE_LOCK:
+        cursor.execute("DELETE FROM chats WHERE user_email = ?", (user_email,))
+    bump_chat_version(user_email)
 
 
 def export_chats_to_csv():
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM chats ORDER BY timestamp ASC")
-    rows = cursor.fetchall()
-    conn.close()
-    if not rows:
+    first = cursor.fetchone()
+    if first is None:
         return ""
-    df = pd.DataFrame([dict(row) for row in rows])
+
+    # Rows go straight from the cursor into the CSV buffer without an intermediate list
     csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
+    writer = csv.writer(csv_buffer, lineterminator="\n")
+    writer.writerow([col[0] for col in cursor.description])
+    writer.writerow(first)
+    writer.writerows(cursor)
     return csv_buffer.getvalue()
 
 
@@ -252,68 +537,91 @@ def export_chats_to_csv():
 def save_uploaded_file(user_email, file_name, file_type, extracted_text):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO uploaded_files (user_email, file_name, file_type, extracted_text)
-        VALUES (?, ?, ?, ?)
-    """, (user_email, file_name, file_type, extracted_text))
-    conn.commit()
-    conn.close()
+    with WRITE_LOCK:
+        cursor.execute("""
+            INSERT INTO uploaded_files (user_email, file_name, file_type, extracted_text)
+            VALUES (?, ?, ?, ?)
+        """, (user_email, file_name, file_type, extracted_text))
 
 
 def get_uploaded_files(user_email):
     conn = get_connection()
-    cursor = conn.cursor()
+    cursor = tuple_cursor(conn)
     cursor.execute("SELECT * FROM uploaded_files WHERE user_email = ? ORDER BY timestamp DESC", (user_email,))
-    files = cursor.fetchall()
-    conn.close()
-    return [dict(f) for f in files]
+    return fetch_dicts(cursor)
 
 
 # ---------------- Email Logs ----------------
+# Email logs are observational, so they are buffered and written in batches rather
+# than paying a commit per email. Each row keeps its own event time.
+EMAIL_LOG_FLUSH_EVERY = 10
+EMAIL_LOG_BUFFER = []
+EMAIL_LOG_LOCK = threading.Lock()
+
+
 def log_email_status(recipient, subject, status, error=None):
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    with EMAIL_LOG_LOCK:
+        EMAIL_LOG_BUFFER.append((recipient, subject, status, error, timestamp))
+        if len(EMAIL_LOG_BUFFER) < EMAIL_LOG_FLUSH_EVERY:
+            return
+    flush_email_logs()
+
+
+def flush_email_logs():
+    with EMAIL_LOG_LOCK:
+        rows = EMAIL_LOG_BUFFER[:]
+        EMAIL_LOG_BUFFER.clear()
+    if not rows:
+        return
+
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO email_logs (recipient, subject, status, error)
-        VALUES (?, ?, ?, ?)
-    """, (recipient, subject, status, error))
-    conn.commit()
-    conn.close()
+    try:
+        with write_transaction(cursor):
+            cursor.executemany("""
+                INSERT INTO email_logs (recipient, subject, status, error, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+    except sqlite3.Error as e:
+        # Put the rows back for the next flush; never let logging fail the send path
+        with EMAIL_LOG_LOCK:
+            EMAIL_LOG_BUFFER[:0] = rows
+        print(f"❌ Failed to write email logs: {e}")
+
+
+atexit.register(flush_email_logs)
 
 
 def get_email_logs(limit=20):
+    flush_email_logs()
     conn = get_connection()
-    cursor = conn.cursor()
+    cursor = tuple_cursor(conn)
     cursor.execute("SELECT * FROM email_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    return fetch_dicts(cursor)
 
 
 # ---------------- Admin/User Helpers ----------------
 def get_all_users():
     conn = get_connection()
-    cursor = conn.cursor()
+    cursor = tuple_cursor(conn)
     cursor.execute("SELECT * FROM users ORDER BY email")
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(u) for u in rows]
+    return fetch_dicts(cursor)
 
 
 def block_user(email, block=True):
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE users SET blocked = ? WHERE email = ?", (1 if block else 0, email))
-    conn.commit()
-    conn.close()
+    with WRITE_LOCK:
+        cursor.execute("UPDATE users SET blocked = ? WHERE email = ?", (1 if block else 0, email))
+    invalidate_user(email)
 
 
 def count_registered_users():
     conn = get_connection()
-    cursor = conn.cursor()
+    cursor = tuple_cursor(conn)
     cursor.execute("SELECT COUNT(*) FROM users")
     count = cursor.fetchone()[0]
-    conn.close()
     return count
 
 
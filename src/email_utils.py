@@ -1,21 +1,66 @@
+import queue
 import smtplib
+import threading
 from email.mime.text import MIMEText
+from string import Template
 import streamlit as st
 from urllib.parse import quote
 
 from src.db import log_email_status
 
+# SMTP settings and base URL, read from Streamlit secrets once at import
+EMAIL_HOST = st.secrets.get("EMAIL_HOST")
+EMAIL_PORT = int(st.secrets.get("EMAIL_PORT", 587))
+EMAIL_USER = st.secrets.get("EMAIL_USER")
+EMAIL_PASSWORD = st.secrets.get("EMAIL_PASSWORD")
+BASE_URL = st.secrets.get("BASE_URL", "http://localhost:8501")
+
+# Seconds before a stalled SMTP socket raises instead of holding SMTP_LOCK indefinitely
+SMTP_TIMEOUT = 20
+
+# One SMTP session reused across sends; smtplib objects aren't thread-safe, so callers hold the lock
+SMTP_SESSION = None
+SMTP_LOCK = threading.Lock()
+
+
+def get_smtp_session(host, port, user, password, reconnect=False):
+    """
+    Return the cached SMTP session, reconnecting (TCP + STARTTLS + AUTH)
+    only when it is missing, dead, or `reconnect` is set. Call with SMTP_LOCK held.
+    """
+    global SMTP_SESSION
+
+    if SMTP_SESSION is not None and not reconnect:
+        try:
+            if SMTP_SESSION.noop()[0] == 250:
+                return SMTP_SESSION
+        except (smtplib.SMTPException, OSError):
+            # OSError covers a socket that timed out or was dropped while idle
+            pass
+
+    if SMTP_SESSION is not None:
+        try:
+            SMTP_SESSION.close()
+        except Exception:
+            pass
+        SMTP_SESSION = None
+
+    server = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+    try:
+        server.starttls()
+        server.login(user, password)
+    except Exception:
+        server.close()
+        raise
+    SMTP_SESSION = server
+    return server
+
 
 def send_email(to_email, subject, body):
     """
     Send an HTML email using SMTP credentials from Streamlit secrets.
     Logs success or failure in the email_logs table.
     """
-    EMAIL_HOST = st.secrets.get("EMAIL_HOST")
-    EMAIL_PORT = int(st.secrets.get("EMAIL_PORT", 587))
-    EMAIL_USER = st.secrets.get("EMAIL_USER")
-    EMAIL_PASSWORD = st.secrets.get("EMAIL_PASSWORD")
-
     if not all([EMAIL_HOST, EMAIL_USER, EMAIL_PASSWORD]):
         print("❌ Email credentials are not fully set in Streamlit secrets.")
         log_email_status(to_email, subject, "failed", "Missing SMTP credentials")
@@ -29,11 +74,14 @@ def send_email(to_email, subject, body):
 
         print(f"[DEBUG] Sending email to {to_email} with subject '{subject}'")
 
-        server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_USER, [to_email], msg.as_string())
-        server.quit()
+        with SMTP_LOCK:
+            server = get_smtp_session(EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD)
+            try:
+                server.sendmail(EMAIL_USER, [to_email], msg.as_string())
+            except smtplib.SMTPServerDisconnected:
+                # Server closed the idle session between the NOOP and the send; retry once
+                server = get_smtp_session(EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD, reconnect=True)
+                server.sendmail(EMAIL_USER, [to_email], msg.as_string())
 
         print(f"✅ Email successfully sent to {to_email}")
         log_email_status(to_email, subject, "sent")
@@ -46,41 +94,73 @@ def send_email(to_email, subject, body):
         return False
 
 
-def send_verification_email(to_email, verification_token):
+# ---------------- Background Mail Queue ----------------
+MAIL_QUEUE = queue.Queue()
+
+
+def mail_worker():
+    # Drains queued (to, subject, body) tuples; send_email logs each result to email_logs
+    while True:
+        to_email, subject, body = MAIL_QUEUE.get()
+        try:
+            send_email(to_email, subject, body)
+        except Exception as e:
+            print(f"❌ Mail worker failed for {to_email}: {e}")
+        finally:
+            MAIL_QUEUE.task_done()
+
+
+threading.Thread(target=mail_worker, name="mail-worker", daemon=True).start()
+
+
+def queue_email(to_email, subject, body):
     """
-    Sends an account verification email with a unique tokenized link.
+    Hand an email to the background worker so the caller doesn't wait on SMTP.
     """
-    base_url = st.secrets.get("BASE_URL", "http://localhost:8501")
-    safe_token = quote(verification_token)   # ✅ URL-encode the token
-    verification_link = f"{base_url}/?verify_token={safe_token}"
+    MAIL_QUEUE.put((to_email, subject, body))
+    return True
 
-    print(f"[DEBUG] Generated verification link for {to_email}: {verification_link}")
 
-    subject = "Verify Your Email - OMNISNT AI Assistant"
-    body = f"""
+# ---------------- Email Templates ----------------
+# Parsed once at import; each send only substitutes the link
+VERIFY_SUBJECT = "Verify Your Email - OMNISNT AI Assistant"
+VERIFY_TEMPLATE = Template("""
         <h3>Welcome to OMNISNT AI Assistant 👋</h3>
         <p>To activate your account, please click the link below:</p>
-        <p><a href="{verification_link}">{verification_link}</a></p>
+        <p><a href="$link">$link</a></p>
+        <p>If you didn’t request this, you can safely ignore this email.</p>
+    """)
+
+RESET_SUBJECT = "Reset Your Password - OMNISNT AI Assistant"
+RESET_TEMPLATE = Template("""
+        <h3>Forgot your password?</h3>
+        <p>Click the link below to reset it:</p>
+        <p><a href="$link">$link</a></p>
         <p>If you didn’t request this, you can safely ignore this email.</p>
+    """)
+
+
+def send_verification_email(to_email, verification_token):
     """
-    return send_email(to_email, subject, body)
+    Sends an account verification email with a unique tokenized link.
+    """
+    safe_token = quote(verification_token)   # ✅ URL-encode the token
+    verification_link = f"{BASE_URL}/?verify_token={safe_token}"
+
+    print(f"[DEBUG] Generated verification link for {to_email}: {verification_link}")
+
+    body = VERIFY_TEMPLATE.substitute(link=verification_link)
+    return queue_email(to_email, VERIFY_SUBJECT, body)
 
 
 def send_reset_email(to_email, reset_token):
     """
     Sends a password reset email with a secure reset token link.
     """
-    base_url = st.secrets.get("BASE_URL", "http://localhost:8501")
     safe_token = quote(reset_token)   # ✅ URL-encode the token
-    reset_link = f"{base_url}/?reset_token={safe_token}"
+    reset_link = f"{BASE_URL}/?reset_token={safe_token}"
 
     print(f"[DEBUG] Generated reset link for {to_email}: {reset_link}")
 
-    subject = "Reset Your Password - OMNISNT AI Assistant"
-    body = f"""
-        <h3>Forgot your password?</h3>
-        <p>Click the link below to reset it:</p>
-        <p><a href="{reset_link}">{reset_link}</a></p>
-        <p>If you didn’t request this, you can safely ignore this email.</p>
-    """
-    return send_email(to_email, subject, body)
+    body = RESET_TEMPLATE.substitute(link=reset_link)
+    return queue_email(to_email, RESET_SUBJECT, body)
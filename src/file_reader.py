@@ -1,8 +1,7 @@
 
-import pandas as pd
-import fitz  # PyMuPDF
-
 def extract_pdf(uploaded_pdf):
+    import fitz  # PyMuPDF, imported lazily so text uploads don't pay for it
+
     doc = fitz.open(stream=uploaded_pdf.read(), filetype="pdf")
     text = ""
     for page in doc:
@@ -13,6 +12,8 @@ def extract_txt(uploaded_txt):
     return uploaded_txt.read().decode("utf-8")
 
 def extract_excel(uploaded_xlsx):
+    import pandas as pd
+
     df = pd.read_excel(uploaded_xlsx)
     return df.to_string(index=False)
 
@@ -1,8 +1,45 @@
 import hashlib
 import hmac
+import os
+import re
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Cheap shape check (something@something.tld) so malformed input never reaches the DB
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+
+def is_valid_email(email) -> bool:
+    return isinstance(email, str) and EMAIL_RE.fullmatch(email) is not None
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p)
+
 
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    # Stored as scrypt$N$r$p$salt$hash so the cost parameters travel with the hash
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def needs_rehash(hashed: str) -> bool:
+    # True for legacy SHA-256 hashes or scrypt hashes made with older cost parameters
+    return not hashed.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
 
 def verify_password(password: str, hashed: str) -> bool:
-    return hmac.compare_digest(hash_password(password), hashed)
+    if not hashed:
+        return False
+    if hashed.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, digest = hashed.split("$")
+            expected = _scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p))
+        except ValueError:
+            return False
+        return hmac.compare_digest(expected.hex(), digest)
+    # Legacy unsalted SHA-256 hashes from before the scrypt switch
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)